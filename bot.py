@@ -1,37 +1,268 @@
 # bot.py
 import os
+import asyncio
+import atexit
 import logging
+import queue
+import re
+import secrets
+import time
 import uuid
-from zoneinfo import ZoneInfo
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from logging.handlers import QueueHandler, QueueListener
 
+import aiosqlite
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, BotCommand
+from telegram.constants import MessageLimit
+from telegram.error import RetryAfter
 from telegram.ext import (
+    AIORateLimiter,
     Application,
     CommandHandler,
     ContextTypes,
     CallbackQueryHandler,
 )
+from telegram.request import HTTPXRequest
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
+
+try:
+    import uvloop
+except ImportError:  # uvloop has no Windows build; the stock loop works too
+    uvloop = None
 
 # -------- CONFIG ----------
 BOT_TOKEN = os.getenv("TOKEN")
 if not BOT_TOKEN:
     raise ValueError("❌ TOKEN not set. Please add it in Railway → Variables")
 
-JKT = ZoneInfo("Asia/Jakarta")  # UTC+7
+# "webhook" (default, for Railway) or "polling" (local dev)
+MODE = os.getenv("MODE", "webhook").lower()
+PORT = int(os.getenv("PORT", 8080))
+PUBLIC_URL = os.getenv("PUBLIC_URL")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+if MODE == "webhook" and not PUBLIC_URL:
+    raise ValueError("❌ PUBLIC_URL not set. Please add it in Railway → Variables (or set MODE=polling)")
+
+DB_PATH = os.getenv("DB_PATH", "remindme.db")
+JOBS_DB_URL = os.getenv("JOBS_DB_URL", "sqlite:///jobs.sqlite")
+PENDING_TTL = 7 * 24 * 3600  # unanswered reminders are forgotten after a week
+MAX_TASKS = int(os.getenv("MAX_TASKS", 100))  # per user
+MAX_TASK_LENGTH = 256  # characters
+
+# Asia/Jakarta has been a fixed UTC+7 with no DST since 1964, so a plain
+# offset gives the same times without any tzdata rule lookups
+JKT = timezone(timedelta(hours=7), name="WIB")
+
+# reminder messages go through one sender task that collects whatever
+# arrives within SEND_WINDOW seconds and sends the batch in parallel; the
+# bounded queue makes send_reminder wait if Telegram can't keep up
+SEND_WINDOW = 0.05
+OUTBOX_SIZE = 1000
+# created in on_startup(): before Python 3.10 a queue binds to the loop
+# current at creation, and main() only sets the uvloop loop later
+outbox = None
+sender_task = None
+
+# scheduler, application & db placeholders
+# jobs are persisted so reminders survive a redeploy; ones that came due while
+# the bot was down still fire within an hour of startup, at most once each
+scheduler = AsyncIOScheduler(
+    jobstores={"default": SQLAlchemyJobStore(url=JOBS_DB_URL)},
+    job_defaults={"misfire_grace_time": 3600, "coalesce": True},
+    timezone=JKT,
+)
+application = None  # will be set in main()
+# reminders due sooner than this (seconds) are timed on the event loop
+# instead of going through the persistent job store. Just over the longest
+# snooze, so every snooze takes the fast path; a clean stop parks unfired
+# timers in the job store, only a crash loses them
+SHORT_DELAY = 31 * 60
+short_timers = {}  # job id → (TimerHandle, run_time, args) still waiting to fire
+background_tasks = set()  # strong refs so spawned tasks aren't GC'd mid-flight
+SHUTDOWN_GRACE = 5  # seconds to let fired reminders reach Telegram on shutdown
+db = None  # aiosqlite connection, opened in on_startup()
+
+# logging: handlers only enqueue records, a listener thread writes them to
+# stderr so a slow pipe never stalls the event loop
+log_queue = queue.Queue(-1)
+log_listener = QueueListener(log_queue, logging.StreamHandler())
+logging.basicConfig(level=logging.INFO, handlers=[QueueHandler(log_queue)])
+log_listener.start()
+atexit.register(log_listener.stop)
+logger = logging.getLogger(__name__)
 
-# in-memory stores
-tasks = {}  # {user_id: [task1, task2, ...]}
-pending_reminders = {}  # {uid: {"user_id":..., "task":..., "task_index":...}}
+# -------- Storage ----------
+# tasks:    one row per todo; idx is a per-user id that only grows, so the
+#           list order is ORDER BY idx and a task keeps its idx for life
+# task_seq: last idx handed out per user, so ids of deleted tasks are never
+#           reused by a newer task (old reminders would point at it)
+# pending: reminders that were sent and are waiting for a button click
+async def init_db():
+    global db
+    db = await aiosqlite.connect(DB_PATH)
+    await db.execute("PRAGMA journal_mode=WAL")
+    await db.execute("PRAGMA synchronous=NORMAL")
+    await db.executescript(
+        """
+        CREATE TABLE IF NOT EXISTS tasks (
+            user_id INTEGER NOT NULL,
+            idx     INTEGER NOT NULL,
+            task    TEXT    NOT NULL,
+            PRIMARY KEY (user_id, idx)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS task_seq (
+            user_id  INTEGER PRIMARY KEY,
+            last_idx INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS pending (
+            uid      TEXT    PRIMARY KEY,
+            user_id  INTEGER NOT NULL,
+            task     TEXT    NOT NULL,
+            task_idx INTEGER NOT NULL,
+            created  REAL    NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS pending_created ON pending (created);
+        """
+    )
+    await db.commit()
+
+
+async def get_tasks(user_id: int):
+    """Return the user's tasks as [(idx, task), ...] in list order."""
+    async with db.execute("SELECT idx, task FROM tasks WHERE user_id = ? ORDER BY idx", (user_id,)) as cur:
+        return await cur.fetchall()
+
+
+async def get_task(user_id: int, idx: int):
+    """Return (number, task) for the task with this idx, where number is its
+    1-based position in /list, or None if the task is gone."""
+    async with db.execute(
+        "SELECT (SELECT COUNT(*) FROM tasks WHERE user_id = ? AND idx <= ?), task "
+        "FROM tasks WHERE user_id = ? AND idx = ?",
+        (user_id, idx, user_id, idx),
+    ) as cur:
+        return await cur.fetchone()
+
+
+async def insert_task(user_id: int, task: str) -> bool:
+    """Append a task; returns False (and stores nothing) once the user
+    already has MAX_TASKS."""
+    async with db.execute(
+        "INSERT INTO task_seq (user_id, last_idx) "
+        "VALUES (?, (SELECT COALESCE(MAX(idx), 0) + 1 FROM tasks WHERE user_id = ?)) "
+        "ON CONFLICT (user_id) DO UPDATE SET last_idx = last_idx + 1 RETURNING last_idx",
+        (user_id, user_id),
+    ) as cur:
+        (idx,) = await cur.fetchone()
+    cur = await db.execute(
+        "INSERT INTO tasks (user_id, idx, task) "
+        "SELECT ?, ?, ? WHERE (SELECT COUNT(*) FROM tasks WHERE user_id = ?) < ?",
+        (user_id, idx, task, user_id, MAX_TASKS),
+    )
+    await db.commit()
+    return cur.rowcount > 0
 
-# scheduler & application placeholders
-scheduler = AsyncIOScheduler()
-application = None  # will be set in main()
 
-# logging
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
+async def remove_task(user_id: int, idx: int) -> bool:
+    cur = await db.execute("DELETE FROM tasks WHERE user_id = ? AND idx = ?", (user_id, idx))
+    await db.commit()
+    return cur.rowcount > 0
+
+
+async def add_pending(uid: str, user_id: int, task: str, task_idx: int):
+    await db.execute(
+        "INSERT INTO pending (uid, user_id, task, task_idx, created) VALUES (?, ?, ?, ?, ?)",
+        (uid, user_id, task, task_idx, time.time()),
+    )
+    await db.commit()
+
+
+async def get_pending(uid: str, user_id: int):
+    """Return (user_id, task, task_idx) for a reminder sent to user_id, or None."""
+    async with db.execute(
+        "SELECT user_id, task, task_idx FROM pending WHERE uid = ? AND user_id = ?", (uid, user_id)
+    ) as cur:
+        return await cur.fetchone()
+
+
+async def take_pending(uid: str, user_id: int):
+    """Delete a reminder sent to user_id and return its (user_id, task,
+    task_idx), or None. Being a single DELETE ... RETURNING, only one of
+    several racing clicks (in this or any other process) gets the row."""
+    async with db.execute(
+        "DELETE FROM pending WHERE uid = ? AND user_id = ? RETURNING user_id, task, task_idx", (uid, user_id)
+    ) as cur:
+        info = await cur.fetchone()
+    await db.commit()
+    return info
+
+
+async def purge_pending():
+    """Drop reminders nobody clicked within PENDING_TTL; runs hourly."""
+    cur = await db.execute("DELETE FROM pending WHERE created < ?", (time.time() - PENDING_TTL,))
+    await db.commit()
+    if cur.rowcount:
+        logger.info(f"🧹 Purged {cur.rowcount} expired reminders")
+
+
+# -------- MarkdownV2 ----------
+# every character MarkdownV2 reserves must be backslash-escaped in user text,
+# otherwise Telegram rejects the whole message
+MDV2_ESCAPES = str.maketrans({c: "\\" + c for c in "\\_*[]()~`>#+-=|{}.!"})
+
+
+def escape_md(text: str) -> str:
+    return text.translate(MDV2_ESCAPES)
+
+
+def utf16_len(text: str) -> int:
+    # Telegram counts message length in UTF-16 code units, so emoji count twice
+    return len(text.encode("utf-16-le")) // 2
+
+
+# -------- Messages ----------
+# texts sent from the reminder path, bound once; MarkdownV2 placeholders
+# expect values that already went through escape_md()
+REMINDER_TEXT = "⏰ Reminder, *{name}*\\! You need to do __*{task}*__ now ⏳".format
+SNOOZE_TEXT = "⏰ How many minutes do you want to be reminded again for *__{task}__*?".format
+TASK_NOT_FOUND = "⚠️ Task not found."
+REMINDER_GONE = "⚠️ This reminder is no longer available."
+
+
+# -------- Keyboards ----------
+# button layouts as (label, callback_data template); only the reminder uid
+# changes from one message to the next
+REMINDER_BUTTONS = (
+    (("✅ Complete", "c:{uid}"), ("⏰ Later", "l:{uid}")),
+)
+SNOOZE_MINUTES = (5, 10, 30)
+SNOOZE_BUTTONS = (
+    tuple((f"{m} min", f"s:{{uid}}:{m}") for m in SNOOZE_MINUTES),
+    (("⬅ Back", "k:{uid}"),),
+)
+# payload text → minutes, for checking snooze callbacks without int()
+SNOOZE_CHOICES = {str(m): m for m in SNOOZE_MINUTES}
+# reminder uids are secrets.token_urlsafe(8): always 11 url-safe characters
+UID_RE = re.compile(r"[A-Za-z0-9_-]{11}")
+
+
+# markups are immutable, so the one built when a reminder is sent is reused
+# when the user comes back to it from the snooze options
+@lru_cache(maxsize=1024)
+def build_keyboard(layout, uid: str) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(
+        [[InlineKeyboardButton(label, callback_data=data.format(uid=uid)) for label, data in row] for row in layout]
+    )
+
+
+# -------- Error reporting ----------
+def log_loop_exception(loop, context):
+    # errors from fire-and-forget tasks would otherwise only show up as
+    # "Task exception was never retrieved" when the task gets collected
+    logger.error(f"❌ Unhandled error in event loop: {context['message']}", exc_info=context.get("exception"))
+
 
 # -------- Bot Command Setup ----------
 async def set_bot_commands(app):
@@ -70,27 +301,44 @@ async def add_task(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
 
-    tasks.setdefault(user_id, []).append(task)
-    await update.message.reply_text(f"✅ Task added: *__{task}__*", parse_mode="MarkdownV2")
+    if len(task) > MAX_TASK_LENGTH:
+        await update.message.reply_text(f"⚠️ Task too long (max {MAX_TASK_LENGTH} characters).")
+        return
+
+    if not await insert_task(user_id, task):
+        await update.message.reply_text(f"⚠️ You already have {MAX_TASKS} tasks. Complete or /delete some first.")
+        return
+
+    await update.message.reply_text(f"✅ Task added: *__{escape_md(task)}__*", parse_mode="MarkdownV2")
 
 
 async def list_tasks(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    user_tasks = tasks.get(user_id, [])
+    user_tasks = await get_tasks(user_id)
     if not user_tasks:
         await update.message.reply_text("📭 Your todo list is empty.")
         return
 
-    text = "📋 *Your Tasks:*\n"
-    for i, task in enumerate(user_tasks, start=1):
-        text += f"{i}. {task}\n"
+    # a long list doesn't fit in one message; split it between tasks so no
+    # part goes over Telegram's limit (escapes counted, to stay on the safe side)
+    parts = [["📋 *Your Tasks:*"]]
+    size = utf16_len(parts[0][0])
+    for i, (_, task) in enumerate(user_tasks, start=1):
+        line = f"{i}\\. {escape_md(task)}"
+        length = utf16_len(line) + 1  # + the joining newline
+        if size + length > MessageLimit.MAX_TEXT_LENGTH:
+            parts.append([])
+            size = -1  # the first line of a part has no newline before it
+        parts[-1].append(line)
+        size += length
 
-    await update.message.reply_text(text, parse_mode="Markdown")
+    for part in parts:
+        await update.message.reply_text("\n".join(part), parse_mode="MarkdownV2")
 
 
 async def delete_task(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    user_tasks = tasks.get(user_id, [])
+    user_tasks = await get_tasks(user_id)
     if not user_tasks:
         await update.message.reply_text("🗑️ You don’t have any tasks to delete.")
         return
@@ -105,193 +353,374 @@ async def delete_task(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.message.reply_text("❌ Invalid task number.")
             return
 
-        deleted_task = user_tasks.pop(task_index)
-        await update.message.reply_text(f"🗑️ Deleted task: *__{deleted_task}__*", parse_mode="MarkdownV2")
+        idx, deleted_task = user_tasks[task_index]
+        if not await remove_task(user_id, idx):
+            # a concurrent /delete or Complete click got there first
+            await update.message.reply_text("❌ Invalid task number.")
+            return
+
+        await update.message.reply_text(f"🗑️ Deleted task: *__{escape_md(deleted_task)}__*", parse_mode="MarkdownV2")
     except ValueError:
         await update.message.reply_text("⚠️ Please enter a valid task number. Example: /delete 2")
 
 
 # -------- Remind command with task selection dropdown ----------
+# /remind <task_number> in <minutes> | at <HH:MM>, checked in one pass
+REMIND_RE = re.compile(r"(\d+)\s+(in|at)\s+(\S+)", re.ASCII | re.IGNORECASE)
+MINUTES_RE = re.compile(r"\d+", re.ASCII)
+HHMM_RE = re.compile(r"(\d{1,2}):(\d{2})", re.ASCII)
+
+
+def parse_in(value: str, now: datetime):
+    if not MINUTES_RE.fullmatch(value):
+        return None
+    try:
+        return now + timedelta(minutes=int(value))
+    except OverflowError:
+        return None
+
+
+def parse_at(value: str, now: datetime):
+    match = HHMM_RE.fullmatch(value)
+    if not match:
+        return None
+    try:
+        run_time = now.replace(hour=int(match[1]), minute=int(match[2]), second=0, microsecond=0)
+    except ValueError:
+        return None
+    return run_time if run_time > now else run_time + timedelta(days=1)
+
+
+# mode → (parser, reply when the value doesn't parse)
+REMIND_MODES = {
+    "in": (parse_in, "⚠️ Example: `/remind 1 in 10` (10 is minutes)."),
+    "at": (parse_at, "⚠️ Example: `/remind 1 at 14:30` (HH:MM in UTC+7)."),
+}
+
+
 async def remind(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    user_tasks = tasks.get(user_id, [])
+    user_tasks = await get_tasks(user_id)
     if not user_tasks:
         await update.message.reply_text("⚠️ You don’t have any tasks yet.")
         return
 
     # If user only types /remind → show inline keyboard to select task
     if len(context.args) == 0:
-        keyboard = [[InlineKeyboardButton(f"{i+1}. {t}", callback_data=f"select_{i}")] for i, t in enumerate(user_tasks)]
+        keyboard = [[InlineKeyboardButton(f"{i+1}. {t}", callback_data=f"x:{idx}")] for i, (idx, t) in enumerate(user_tasks)]
         await update.message.reply_text("Select a task to set a reminder:", reply_markup=InlineKeyboardMarkup(keyboard))
         return
 
     # If user types /remind <task_number> in <minutes> or at <HH:MM>
-    if len(context.args) < 3:
+    match = REMIND_RE.fullmatch(" ".join(context.args))
+    if not match:
         await update.message.reply_text(
-            "⚠️ Usage:\n/remind <task_number> in <minutes>\n/remind <task_number> at <HH:MM>\n"
+            "⚠️ Usage:\n/remind <task\\_number\\> in <minutes\\>\n/remind <task\\_number\\> at <HH:MM\\>\n"
             "Example: `/remind 1 in 10` or `/remind 2 at 14:30`",
             parse_mode="MarkdownV2"
         )
         return
 
-    try:
-        task_index = int(context.args[0]) - 1
-        task = user_tasks[task_index]
-    except (ValueError, IndexError):
+    number, mode, value = match.groups()
+    task_index = int(number) - 1
+    if not 0 <= task_index < len(user_tasks):
         await update.message.reply_text("⚠️ Invalid task number.")
         return
 
-    mode = context.args[1].lower()
-    now = datetime.now(JKT)
-    if mode == "in":
-        try:
-            minutes = int(context.args[2])
-            run_time = now + timedelta(minutes=minutes)
-        except (IndexError, ValueError):
-            await update.message.reply_text("⚠️ Example: `/remind 1 in 10` (10 is minutes).")
-            return
-    elif mode == "at":
-        try:
-            hour, minute = map(int, context.args[2].split(":"))
-            run_time = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
-            if run_time <= now:
-                run_time += timedelta(days=1)
-        except (IndexError, ValueError):
-            await update.message.reply_text("⚠️ Example: `/remind 1 at 14:30` (HH:MM in UTC+7).")
-            return
-    else:
-        await update.message.reply_text("⚠️ Use `in <minutes>` or `at <HH:MM>`.")
+    idx, task = user_tasks[task_index]
+    parse, example = REMIND_MODES[mode.lower()]
+    run_time = parse(value, datetime.now(JKT))
+    if run_time is None:
+        await update.message.reply_text(example)
         return
 
     formatted_time = run_time.strftime("%d %b %Y, %H:%M (UTC+7)")
-    scheduler.add_job(send_reminder, "date", run_date=run_time, args=[user_id, task, task_index])
+    await schedule_reminder(run_time, user_id, task, idx, update.effective_user.first_name)
     await update.message.reply_text(
-        f"✅ Reminder set for task {task_index + 1}: *__{task}__*\n⏰ At {formatted_time}",
+        f"✅ Reminder set for task {task_index + 1}: *__{escape_md(task)}__*\n⏰ At {escape_md(formatted_time)}",
         parse_mode="MarkdownV2"
     )
 
 
 # -------- Reminder sender & callbacks ----------
-async def send_reminder(user_id: int, task: str, task_index: int):
-    bot = application.bot
-    try:
-        chat = await bot.get_chat(user_id)
-        name = getattr(chat, "first_name", None) or getattr(chat, "full_name", None) or getattr(chat, "username", None) or "there"
-    except Exception:
-        name = "there"
-
-    uid = uuid.uuid4().hex
-    pending_reminders[uid] = {"user_id": user_id, "task": task, "task_index": task_index}
-
-    keyboard = [
-        [
-            InlineKeyboardButton("✅ Complete", callback_data=f"complete_{uid}"),
-            InlineKeyboardButton("⏰ Later", callback_data=f"later_{uid}")
-        ]
-    ]
-    await bot.send_message(
+async def send_queued(message: dict):
+    # flood control isn't a failure: Telegram says when to try again, and
+    # dropping the message would lose the reminder for good, so keep trying
+    # after the rate limiter's own retries run out
+    while True:
+        try:
+            await application.bot.send_message(**message)
+            return
+        except RetryAfter as exc:
+            logger.warning(f"⏳ Rate limited sending to {message['chat_id']}, retrying in {exc.retry_after}s")
+            await asyncio.sleep(exc.retry_after)
+
+
+def spawn(coro_fn, *args):
+    task = asyncio.create_task(coro_fn(*args))
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+
+def fire_short_timer(job_id: str):
+    _, _, args = short_timers.pop(job_id)
+    spawn(send_reminder, *args)
+
+
+async def schedule_reminder(run_time: datetime, user_id: int, task: str, task_idx: int, name: str):
+    job_id = uuid.uuid4().hex
+    args = [user_id, task, task_idx, name]
+    delay = (run_time - datetime.now(JKT)).total_seconds()
+    if delay < SHORT_DELAY:
+        # skip the job store write and let the loop's timer heap fire it;
+        # on a clean shutdown unfired timers are moved to the job store
+        handle = asyncio.get_running_loop().call_later(max(delay, 0), fire_short_timer, job_id)
+        short_timers[job_id] = (handle, run_time, args)
+        return
+
+    # add_job writes to the SQLAlchemy job store synchronously; do that in a
+    # worker thread (the scheduler's wakeup is thread-safe) so the event loop
+    # keeps serving updates meanwhile
+    await asyncio.to_thread(
+        scheduler.add_job,
+        send_reminder, "date", run_date=run_time, args=args, id=job_id, replace_existing=True,
+    )
+
+
+async def sender_loop():
+    while True:
+        batch = [await outbox.get()]
+        await asyncio.sleep(SEND_WINDOW)
+        while not outbox.empty():
+            batch.append(outbox.get_nowait())
+
+        results = await asyncio.gather(*(send_queued(m) for m in batch), return_exceptions=True)
+        for message, result in zip(batch, results):
+            if isinstance(result, Exception):
+                logger.error(f"❌ Failed to send reminder to {message['chat_id']}", exc_info=result)
+            outbox.task_done()
+
+
+def log_sender_exit(task: asyncio.Task):
+    # sender_loop only ends by being cancelled; anything else means reminders
+    # would pile up in the outbox unsent, so make sure it gets noticed
+    if not task.cancelled():
+        logger.error("❌ Reminder sender stopped", exc_info=task.exception())
+
+
+async def drain_reminders():
+    """Wait for fired reminders to be queued and for the outbox to empty."""
+    if background_tasks:
+        await asyncio.wait(background_tasks)
+    await outbox.join()
+
+
+async def send_reminder(user_id: int, task: str, task_idx: int, name: str = None):
+    # the task may have been deleted or completed since this was scheduled
+    if not await get_task(user_id, task_idx):
+        logger.info(f"⏭️ Skipping reminder for removed task {task_idx} of {user_id}")
+        return
+
+    # 11 url-safe chars (64 random bits) keeps callback_data well under
+    # Telegram's 64-byte limit; uids only need to be unique among pending rows
+    uid = secrets.token_urlsafe(8)
+    await add_pending(uid, user_id, task, task_idx)
+
+    await outbox.put(dict(
         chat_id=user_id,
-        text=f"⏰ Reminder, *{name}*! You need to do __*{task}*__ now ⏳",
+        text=REMINDER_TEXT(name=escape_md(name or "there"), task=escape_md(task)),
         parse_mode="MarkdownV2",
-        reply_markup=InlineKeyboardMarkup(keyboard)
+        reply_markup=build_keyboard(REMINDER_BUTTONS, uid)
+    ))
+
+
+# callback_data is "<action>:<payload>" with a one-letter action:
+#   x:<task idx>        task picked from the /remind keyboard
+#   c:<uid>             reminder completed
+#   l:<uid>             reminder postponed → show snooze options
+#   s:<uid>:<minutes>   snooze picked
+#   k:<uid>             back from the snooze options
+async def select_callback(query, payload: str):
+    # callback carries the task's idx, not its list position, so the
+    # button still points at the right task if the list changed since
+    if not (payload.isascii() and payload.isdigit()):
+        return
+    found = await get_task(query.from_user.id, int(payload))
+    if not found:
+        await query.edit_message_text(TASK_NOT_FOUND)
+        return
+
+    number, task = found
+    await query.edit_message_text(
+        f"Selected task: *__{escape_md(task)}__*\n\nNow use `/remind {number} in <minutes>` or `/remind {number} at <HH:MM>` to set a reminder\\.",
+        parse_mode="MarkdownV2"
     )
 
 
-async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    await query.answer()
-    data = query.data.split("_")
-    action = data[0]
-    uid = data[1]
-
-    # SELECT task from dropdown → show how to set reminder next
-    if action == "select":
-        task_index = int(uid)
-        user_id = query.from_user.id
-        task = tasks[user_id][task_index]
-        await query.edit_message_text(
-            f"Selected task: *__{task}__*\n\nNow use `/remind {task_index+1} in <minutes>` or `/remind {task_index+1} at <HH:MM>` to set a reminder.",
-            parse_mode="MarkdownV2"
-        )
-        return
+async def load_reminder(query, uid: str, fetch=get_pending):
+    """Return (user_id, task, task_idx) for a pending reminder, telling the
+    user when it is gone. Only the user the reminder was sent to can act on
+    it. Callbacks that end the reminder pass fetch=take_pending so
+    concurrent clicks can't both act on it."""
+    if not UID_RE.fullmatch(uid):
+        # not a uid this bot hands out; ignore it without a database lookup
+        return None
+    info = await fetch(uid, query.from_user.id)
+    if not info:
+        await query.edit_message_text(REMINDER_GONE)
+    return info
 
-    info = pending_reminders.get(uid)
+
+async def complete_callback(query, uid: str):
+    info = await load_reminder(query, uid, fetch=take_pending)
     if not info:
-        await query.edit_message_text("⚠️ This reminder is no longer available.")
         return
 
-    user_id = info["user_id"]
-    task = info["task"]
-    task_index = info["task_index"]
-    user_tasks = tasks.get(user_id, [])
-
-    if action == "complete":
-        removed = False
-        if task in user_tasks:
-            user_tasks.remove(task)
-            removed = True
-        elif 0 <= task_index < len(user_tasks):
-            user_tasks.pop(task_index)
-            removed = True
-
-        if removed:
-            await query.edit_message_text(f"✅ Task completed and removed: *__{task}__*", parse_mode="MarkdownV2")
-        else:
-            await query.edit_message_text("⚠️ Task not found.")
-
-        pending_reminders.pop(uid, None)
-        return
+    user_id, task, task_idx = info
+    if await remove_task(user_id, task_idx):
+        await query.edit_message_text(f"✅ Task completed and removed: *__{escape_md(task)}__*", parse_mode="MarkdownV2")
+    else:
+        await query.edit_message_text(TASK_NOT_FOUND)
 
-    if action == "later":
-        keyboard = [
-            [
-                InlineKeyboardButton("5 min", callback_data=f"snooze_{uid}_5"),
-                InlineKeyboardButton("10 min", callback_data=f"snooze_{uid}_10"),
-                InlineKeyboardButton("30 min", callback_data=f"snooze_{uid}_30")
-            ],
-            [InlineKeyboardButton("⬅ Back", callback_data=f"back_{uid}")]
-        ]
-        await query.edit_message_text(
-            f"⏰ How many minutes do you want to be reminded again for *__{task}__*?",
-            parse_mode="MarkdownV2",
-            reply_markup=InlineKeyboardMarkup(keyboard)
-        )
+
+async def later_callback(query, uid: str):
+    info = await load_reminder(query, uid)
+    if not info:
         return
 
-    if action == "snooze":
-        minutes = int(data[2])
-        run_time = datetime.now(JKT) + timedelta(minutes=minutes)
-        scheduler.add_job(send_reminder, "date", run_date=run_time, args=[user_id, task, task_index])
-        await query.edit_message_text(f"🔔 Okay! I’ll remind you again in {minutes} minutes:\n👉 {task}")
-        pending_reminders.pop(uid, None)
+    _, task, _ = info
+    await query.edit_message_text(
+        SNOOZE_TEXT(task=escape_md(task)),
+        parse_mode="MarkdownV2",
+        reply_markup=build_keyboard(SNOOZE_BUTTONS, uid)
+    )
+
+
+async def snooze_callback(query, payload: str):
+    uid, _, choice = payload.partition(":")
+    # only the offered durations are accepted, and checked before the
+    # reminder is claimed so a malformed payload can't consume it
+    minutes = SNOOZE_CHOICES.get(choice)
+    if minutes is None:
+        return
+    info = await load_reminder(query, uid, fetch=take_pending)
+    if not info:
         return
 
-    if action == "back":
-        keyboard = [
-            [
-                InlineKeyboardButton("✅ Complete", callback_data=f"complete_{uid}"),
-                InlineKeyboardButton("⏰ Later", callback_data=f"later_{uid}")
-            ]
-        ]
-        await query.edit_message_text(
-            f"⏰ Reminder, *{query.from_user.first_name}*! You need to do __*{task}*__ now ⏳",
-            parse_mode="MarkdownV2",
-            reply_markup=InlineKeyboardMarkup(keyboard)
-        )
+    user_id, task, task_idx = info
+    run_time = datetime.now(JKT) + timedelta(minutes=minutes)
+    await schedule_reminder(run_time, user_id, task, task_idx, query.from_user.first_name)
+    await query.edit_message_text(f"🔔 Okay! I’ll remind you again in {minutes} minutes:\n👉 {task}")
+
+
+async def back_callback(query, uid: str):
+    info = await load_reminder(query, uid)
+    if not info:
         return
 
+    _, task, _ = info
+    await query.edit_message_text(
+        REMINDER_TEXT(name=escape_md(query.from_user.first_name), task=escape_md(task)),
+        parse_mode="MarkdownV2",
+        reply_markup=build_keyboard(REMINDER_BUTTONS, uid)
+    )
+
+
+CALLBACKS = {
+    "x": select_callback,
+    "c": complete_callback,
+    "l": later_callback,
+    "s": snooze_callback,
+    "k": back_callback,
+}
+
+
+async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    # answering only stops the client's spinner, so send it alongside the
+    # edit instead of waiting a full round-trip for it first
+    answering = spawn(query.answer)
+    try:
+        # buttons from before this format (complete_…, snooze_…) or anything
+        # unknown have no one-letter action before a ':' and are ignored
+        action, sep, payload = (query.data or "").partition(":")
+        callback = CALLBACKS.get(action) if sep else None
+        if callback:
+            await callback(query, payload)
+    finally:
+        await answering
+
 
 # -------- Main ----------
 def main():
     global application
-    application = Application.builder().token(BOT_TOKEN).build()
+    if uvloop:
+        # uvloop.install() is deprecated from Python 3.12, and uvloop's policy
+        # refuses to create a loop in get_event_loop(), which run_polling and
+        # run_webhook call; so hand asyncio a ready uvloop loop instead
+        asyncio.set_event_loop(uvloop.new_event_loop())
+
+    # HTTP/2 lets concurrent API calls share one kept-alive connection. The
+    # getUpdates client stays separate so a pending long-poll never holds a
+    # connection the API calls need (PTB adds the poll timeout to its read
+    # timeout on its own); API calls get a longer read timeout so a slow
+    # burst doesn't surface as TimedOut errors. The rate limiter paces every
+    # API call to Telegram's limits (30 messages/sec overall, 20/min per
+    # group); in-flight caps alone don't, since HTTP/2 sends clear much faster.
+    # On a 429 it holds back all calls for the requested time and retries
+    application = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .request(HTTPXRequest(connection_pool_size=100, http_version="2", read_timeout=30, connect_timeout=5))
+        .get_updates_request(HTTPXRequest(http_version="2", connect_timeout=5))
+        .rate_limiter(AIORateLimiter(max_retries=2))
+        .build()
+    )
 
     async def on_startup(app):
+        global outbox, sender_task
+        asyncio.get_running_loop().set_exception_handler(log_loop_exception)
+        await init_db()
+        outbox = asyncio.Queue(maxsize=OUTBOX_SIZE)
+        sender_task = asyncio.create_task(sender_loop())
+        sender_task.add_done_callback(log_sender_exit)
         scheduler.start()
+        scheduler.add_job(purge_pending, "interval", hours=1, id="purge_pending", replace_existing=True)
+        if MODE == "polling":
+            # a leftover webhook makes getUpdates fail with a conflict
+            await app.bot.delete_webhook()
         await set_bot_commands(app)
         logger.info("✅ Scheduler started and bot commands set")
 
+    async def on_stop(app):
+        if not scheduler.running:  # startup failed before anything ran
+            return
+
+        # reminders waiting on the loop's timer would die with the process;
+        # park them in the job store so they fire after the restart
+        for job_id, (handle, run_time, args) in short_timers.items():
+            handle.cancel()
+            scheduler.add_job(send_reminder, "date", run_date=run_time, args=args, id=job_id, replace_existing=True)
+        short_timers.clear()
+        scheduler.shutdown(wait=False)
+
+        # the bot's HTTP client is closed right after this, so let
+        # reminders that already fired go out first
+        try:
+            await asyncio.wait_for(drain_reminders(), SHUTDOWN_GRACE)
+        except asyncio.TimeoutError:
+            logger.warning("⚠️ Shutting down with unsent reminders")
+        sender_task.cancel()
+        logger.info("👋 Scheduler stopped")
+
+    async def on_shutdown(app):
+        if db:
+            await db.close()
+
     application.post_init = on_startup
+    application.post_stop = on_stop
+    application.post_shutdown = on_shutdown
 
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("add", add_task))
@@ -300,8 +729,34 @@ def main():
     application.add_handler(CommandHandler("remind", remind))
     application.add_handler(CallbackQueryHandler(button_handler))
 
-    logger.info("🚀 Bot is running...")
-    application.run_polling()
+    # the bot only reacts to commands and button presses, so Telegram needn't
+    # serialize (or wake us for) any other update type
+    allowed_updates = [Update.MESSAGE, Update.CALLBACK_QUERY]
+
+    logger.info(f"🚀 Bot is running ({MODE})...")
+    if MODE == "polling":
+        # long-poll for 30 s per getUpdates instead of PTB's 10 s; local dev
+        # only, so commands sent while the bot was down can be dropped
+        application.run_polling(
+            timeout=30,
+            poll_interval=0.0,
+            drop_pending_updates=True,
+            allowed_updates=allowed_updates,
+        )
+    else:
+        if not WEBHOOK_SECRET:
+            # without it anyone who learns the URL can post fake updates
+            logger.warning("⚠️ WEBHOOK_SECRET not set; webhook requests are not authenticated")
+        # PTB's webhook server acks each POST right away and processes the
+        # update in the background, so Telegram never has to retry
+        application.run_webhook(
+            listen="0.0.0.0",
+            port=PORT,
+            url_path=BOT_TOKEN,
+            webhook_url=f"{PUBLIC_URL.rstrip('/')}/{BOT_TOKEN}",
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=allowed_updates,
+        )
 
 
 if __name__ == "__main__":